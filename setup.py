@@ -16,7 +16,7 @@
    limitations under the License.
 """
 
-from setuptools import setup
+from setuptools import setup, Extension
 
 import os
 
@@ -39,10 +39,25 @@ dependencies = [
     'python-irodsclient',
     'pyinotify',
     'expiringdict',
+    'fastrlock',
+    'scandir',
     'boto3',
     'dropbox'
 ]
 
+# compiled helpers are opt-in (SGFSDRIVER_BUILD_EXT=1, requires Cython)
+# since they make the package arch-dependent.
+# sgfsdriver.lib.pathutil falls back to pure-python code without them
+ext_modules = []
+if os.environ.get('SGFSDRIVER_BUILD_EXT') == '1':
+    from Cython.Build import cythonize
+    ext_modules = cythonize([
+        Extension(
+            'sgfsdriver.lib._pathutil',
+            ['src/sgfsdriver/lib/_pathutil.pyx']
+        )
+    ])
+
 setup(
     name='sgfsdriver',
     version='0.1',
@@ -56,5 +71,6 @@ setup(
         'sgfsdriver': 'src/sgfsdriver'
     },
     install_requires=dependencies,
+    ext_modules=ext_modules,
     zip_safe=False
 )
@@ -0,0 +1,95 @@
+# cython: language_level=2
+
+"""
+   Copyright 2016 The Trustees of University of Arizona
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Compiled version of sgfsdriver.lib.pathutil
+"""
+
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_GET_SIZE, \
+    PyBytes_FromStringAndSize
+from libc.string cimport memcmp, memcpy
+
+cdef char SEP = b"/"
+
+
+cdef inline Py_ssize_t _rstrip_len(const char* s, Py_ssize_t n):
+    while n > 0 and s[n - 1] == SEP:
+        n -= 1
+    return n
+
+
+cdef inline bint _startswith(const char* s, Py_ssize_t n,
+                             const char* prefix, Py_ssize_t prefix_len):
+    return n >= prefix_len and memcmp(s, prefix, prefix_len) == 0
+
+
+def to_ascii(path):
+    # paths given are mostly ascii str already; only unicode needs encoding
+    if isinstance(path, bytes):
+        return path
+    try:
+        # strict ascii encoding takes the codec shortcut
+        return path.encode('ascii')
+    except UnicodeEncodeError:
+        return path.encode('ascii', 'ignore')
+
+
+def make_sub_path(bytes root not None, bytes path not None):
+    # convert a path to a path under root
+    cdef const char* r = PyBytes_AS_STRING(root)
+    cdef Py_ssize_t rlen = PyBytes_GET_SIZE(root)
+    cdef const char* p = PyBytes_AS_STRING(path)
+    cdef Py_ssize_t plen = PyBytes_GET_SIZE(path)
+    cdef Py_ssize_t n = _rstrip_len(p, plen)
+    cdef Py_ssize_t sep_len = 1
+    cdef bytes result
+    cdef char* out
+
+    if _startswith(p, plen, r, rlen):
+        if (plen == 1 and p[0] == SEP) or n == plen:
+            return path
+        return PyBytes_FromStringAndSize(p, n)
+
+    if plen > 0 and p[0] == SEP:
+        sep_len = 0
+
+    result = PyBytes_FromStringAndSize(NULL, rlen + sep_len + n)
+    out = PyBytes_AS_STRING(result)
+    memcpy(out, r, rlen)
+    if sep_len:
+        out[rlen] = SEP
+    memcpy(out + rlen + sep_len, p, n)
+    return result
+
+
+def make_driver_path(bytes root not None, bytes path not None):
+    # convert a path under root to a path relative to root
+    cdef const char* r = PyBytes_AS_STRING(root)
+    cdef Py_ssize_t rlen = PyBytes_GET_SIZE(root)
+    cdef const char* p = PyBytes_AS_STRING(path)
+    cdef Py_ssize_t plen = PyBytes_GET_SIZE(path)
+    cdef Py_ssize_t start = 0
+    cdef Py_ssize_t n
+
+    if _startswith(p, plen, r, rlen):
+        start = rlen
+
+    n = _rstrip_len(p + start, plen - start)
+    if start == 0 and n == plen:
+        return path
+    return PyBytes_FromStringAndSize(p + start, n)
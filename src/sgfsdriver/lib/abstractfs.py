@@ -146,6 +146,17 @@ class afsbase(object):
     def list_dir(self, dirpath):
         pass
 
+    # list directory entries with their stats
+    # and return a list of (name, afsstat) tuples
+    # entries removed while listing are left out
+    def list_dir_stat(self, dirpath):
+        entries = []
+        for name in self.list_dir(dirpath):
+            st = self.stat(dirpath.rstrip("/") + "/" + name)
+            if st:
+                entries.append((name, st))
+        return entries
+
     # check if given path is a directory and return True/False
     @abstractmethod
     def is_dir(self, dirpath):
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+   Copyright 2016 The Trustees of University of Arizona
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Lock helpers shared by plugins.
+"""
+
+from fastrlock.rlock import FastRLock
+
+# must be a power of 2
+LOCK_SHARDS = 64
+
+
+class _shard_locks(object):
+    """
+    Locks a few shards of a sharded_lock in the given order
+    """
+    def __init__(self, locks):
+        self._locks = locks
+
+    def __enter__(self):
+        for lock in self._locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for lock in reversed(self._locks):
+            lock.release()
+
+
+class sharded_lock(object):
+    """
+    A set of re-entrant locks, one is picked by the hash of a path.
+    Using the object itself as a context manager locks all shards.
+    """
+    def __init__(self, shards=LOCK_SHARDS):
+        if shards <= 0 or shards & (shards - 1):
+            raise ValueError("shards must be a power of 2")
+
+        self.locks = [FastRLock() for _ in range(shards)]
+        self._mask = shards - 1
+
+    def __len__(self):
+        return len(self.locks)
+
+    def shard(self, path):
+        return hash(path) & self._mask
+
+    def lockfor(self, path):
+        return self.locks[hash(path) & self._mask]
+
+    def locksfor(self, *paths):
+        # in the same order as acquire_all to avoid deadlocks
+        shards = sorted(set(self.shard(path) for path in paths))
+        return _shard_locks([self.locks[shard] for shard in shards])
+
+    def acquire_all(self):
+        # always in the same order to avoid deadlocks
+        for lock in self.locks:
+            lock.acquire()
+
+    def release_all(self):
+        for lock in reversed(self.locks):
+            lock.release()
+
+    def __enter__(self):
+        self.acquire_all()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_all()
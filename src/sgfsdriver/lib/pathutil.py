@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+"""
+   Copyright 2016 The Trustees of University of Arizona
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Path conversion helpers shared by plugins.
+The compiled _pathutil module is used instead if it is built.
+"""
+
+from fastrlock.rlock import FastRLock
+
+PATH_CACHE_SIZE = 8192
+
+# process-wide path converters (root -> path_converter)
+_path_converters = {}
+# lookups are atomic dict reads, the lock only serializes inserts
+_path_cache_lock = FastRLock()
+
+
+def to_ascii(path):
+    # paths given are mostly ascii str already; only unicode needs encoding
+    if isinstance(path, str):
+        return path
+    try:
+        # strict ascii encoding takes the codec shortcut
+        return path.encode('ascii')
+    except UnicodeEncodeError:
+        return path.encode('ascii', 'ignore')
+
+
+def make_sub_path(root, path):
+    # convert a path to a path under root
+    if path.startswith(root):
+        if path == "/":
+            return path
+        else:
+            return path.rstrip("/")
+
+    if path.startswith("/"):
+        return root + path.rstrip("/")
+
+    return root + "/" + path.rstrip("/")
+
+
+def make_driver_path(root, path):
+    # convert a path under root to a path relative to root
+    if path.startswith(root):
+        return path[len(root):].rstrip("/")
+    return path.rstrip("/")
+
+
+def _cache_path(cache, key, path):
+    # interned so repeated paths share one string object
+    path = intern(path)
+    with _path_cache_lock:
+        if len(cache) >= PATH_CACHE_SIZE:
+            cache.popitem()
+        cache[key] = path
+    return path
+
+
+class path_converter(object):
+    """
+    Converts paths for a root, caching results by the raw path
+    """
+    def __init__(self, root):
+        self.root = to_ascii(root)
+        self._sub_path_cache = {}
+        self._driver_path_cache = {}
+
+    def sub_path(self, path):
+        sub_path = self._sub_path_cache.get(path)
+        if sub_path is None:
+            sub_path = _cache_path(
+                self._sub_path_cache, path, make_sub_path(self.root, path))
+        return sub_path
+
+    def driver_path(self, path):
+        driver_path = self._driver_path_cache.get(path)
+        if driver_path is None:
+            driver_path = _cache_path(
+                self._driver_path_cache, path,
+                make_driver_path(self.root, path))
+        return driver_path
+
+
+def get_path_converter(root):
+    # converters are shared by all plugin instances with the same root
+    converter = _path_converters.get(root)
+    if converter is None:
+        with _path_cache_lock:
+            converter = _path_converters.get(root)
+            if converter is None:
+                converter = path_converter(root)
+                _path_converters[root] = converter
+    return converter
+
+
+try:
+    from sgfsdriver.lib._pathutil import to_ascii, make_sub_path, \
+        make_driver_path
+except ImportError:
+    pass
@@ -31,16 +31,31 @@ from expiringdict import ExpiringDict
 from io import BytesIO
 
 logger = logging.getLogger('irods_client')
-logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('irods_client.log')
-fh.setLevel(logging.DEBUG)
-# create formatter and add it to the handlers
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
+# only warnings and errors are logged (to stderr) unless a log dir is
+# configured
+logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+sh.setLevel(logging.WARNING)
+sh.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(sh)
+
+
+def configure_logger(log_dir):
+    if logger.level == logging.DEBUG:
+        # already configured
+        return
+
+    logger.setLevel(logging.DEBUG)
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(os.path.join(log_dir, 'irods_client.log'))
+    fh.setLevel(logging.DEBUG)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(fh)
 
 METADATA_CACHE_SIZE = 10000
 METADATA_CACHE_TTL = 60 * 60     # 1 hour
@@ -141,7 +156,7 @@ class irods_object_pool(object):
         self.lock()
 
         for obj in self.objects.values():
-            logger.info("close : %s" % obj.path)
+            logger.debug("close : %s", obj.path)
 
             obj.lock()
             try:
@@ -161,7 +176,7 @@ class irods_object_pool(object):
         self._lock.release()
 
     def _new_dataobject(self, path, offset=0):
-        logger.info("_new_dataobject : %s, off(%d)" % (path, offset))
+        logger.debug("_new_dataobject : %s, off(%d)", path, offset)
 
         self.lock()
         try:
@@ -179,7 +194,7 @@ class irods_object_pool(object):
 
     def _close_dataobject(self, obj):
         path = obj.path
-        logger.info("_close_dataobject : %s" % path)
+        logger.debug("_close_dataobject : %s", path)
 
         self.lock()
         obj.lock()
@@ -194,7 +209,7 @@ class irods_object_pool(object):
 
     def _get_dataobject(self, path, offset):
         obj = None
-        logger.info("_get_dataobject : %s, off(%d)" % (path, offset))
+        logger.debug("_get_dataobject : %s, off(%d)", path, offset)
 
         self.lock()
 
@@ -246,7 +261,7 @@ class irods_object_pool(object):
         return obj
 
     def read_data(self, path, offset, size):
-        logger.info("read_data : %s, off(%d), size(%d)" % (path, offset, size))
+        logger.debug("read_data : %s, off(%d), size(%d)", path, offset, size)
 
         #obj is locked
         self.lock()
@@ -300,13 +315,13 @@ class prefetch_task(threading.Thread):
         self.data = None
 
     def run(self):
-        logger.info("prefetch_task : %s, off(%d), size(%d)" % (self.path, self.offset, self.size))
+        logger.debug("prefetch_task : %s, off(%d), size(%d)", self.path, self.offset, self.size)
         object_pool = self.irods_client.get_object_pool()
         object_pool.lock()
         buf = None
         try:
             buf = object_pool.read_data(self.path, self.offset, self.size)
-            logger.info("prefetch_task: read done")
+            logger.debug("prefetch_task: read done")
         except Exception, e:
             logger.error("prefetch_task: " + traceback.format_exc())
         finally:
@@ -343,7 +358,7 @@ class irods_client(object):
         )
 
     def connect(self):
-        logger.info("connect: connecting to iRODS server (%s)" % self.host)
+        logger.info("connect: connecting to iRODS server (%s)", self.host)
         self.session = iRODSSession(
             host=self.host,
             port=self.port,
@@ -361,6 +376,11 @@ class irods_client(object):
             pass
 
     def reconnect(self):
+        # a running prefetch uses the session
+        prefetch_thread = self.prefetch_thread
+        if prefetch_thread:
+            prefetch_thread.join()
+
         self.close()
         self.connect()
 
@@ -375,9 +395,11 @@ class irods_client(object):
         return self.object_pool
 
     def _ensureDirEntryStatLoaded(self, path):
-        # reuse cache
-        if path in self.meta_cache:
-            return self.meta_cache[path]
+        # reuse cache. a single lookup, as an entry can be evicted by an
+        # insert for another path at any time
+        stats = self.meta_cache.get(path)
+        if stats is not None:
+            return stats
 
         coll = self.session.collections.get(path)
         stats = []
@@ -391,12 +413,12 @@ class irods_client(object):
         return stats
 
     def _invoke_prefetch(self, path, offset, size):
-        logger.info("_invoke_prefetch : %s, off(%d), size(%d)" % (path, offset, size))
+        logger.debug("_invoke_prefetch : %s, off(%d), size(%d)", path, offset, size)
         self.prefetch_thread = prefetch_task(name="prefetch_task_thread", kwargs={'session':self.session, 'path':path, 'offset':offset, 'size':size, 'irods_client':self})
         self.prefetch_thread.start()
 
     def _get_prefetch_data(self, path, offset, size):
-        logger.info("_get_prefetch_data : %s, off(%d), size(%d)" % (path, offset, size))
+        logger.debug("_get_prefetch_data : %s, off(%d), size(%d)", path, offset, size)
         invoke_new_thread = False
         if self.prefetch_thread:
             if not self.prefetch_thread.complete:
@@ -450,6 +472,15 @@ class irods_client(object):
                 entries.append(sb.name)
         return entries
 
+    """
+    Returns irods_status of directory entries
+    """
+    def list_dir_stat(self, path):
+        stats = self._ensureDirEntryStatLoaded(path)
+        if stats:
+            return list(stats)
+        return []
+
     def is_dir(self, path):
         sb = self.stat(path)
         if sb:
@@ -473,22 +504,39 @@ class irods_client(object):
         except (CollectionDoesNotExist, DataObjectDoesNotExist):
             return False
 
+    def is_stat_cache_empty(self):
+        return len(self.meta_cache) == 0
+
     def clear_stat_cache(self, path=None):
         if(path):
-            if path in self.meta_cache:
-                # directory
-                del self.meta_cache[path]
-            else:
+            # directory
+            if self.meta_cache.pop(path, None) is None:
                 # file
-                parent = os.path.dirname(path)
-                if parent in self.meta_cache:
-                    del self.meta_cache[parent]
+                self.meta_cache.pop(os.path.dirname(path), None)
         else:
             self.meta_cache.clear()
 
+    """
+    Returns irods_status fetched from iRODS directly, not from the cache
+    """
+    def refresh_stat(self, path):
+        self.clear_stat_cache(path)
+        # a single query instead of listing the parent dir as stat does
+        try:
+            return irods_status.fromDataObject(
+                self.session.data_objects.get(path))
+        except (CollectionDoesNotExist, DataObjectDoesNotExist):
+            pass
+
+        try:
+            return irods_status.fromCollection(
+                self.session.collections.get(path))
+        except (CollectionDoesNotExist):
+            return None
+
     def read(self, path, offset, size):
-        logger.info(
-            "read : %s, off(%d), size(%d)" % (path, offset, size)
+        logger.debug(
+            "read : %s, off(%d), size(%d)", path, offset, size
         )
         buf = None
         try:
@@ -498,16 +546,20 @@ class irods_client(object):
                 buf = BytesIO()
                 return buf.getvalue()
 
-            time1 = datetime.now()
+            # timing is only measured when it is logged
+            debug = logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                time1 = datetime.now()
             buf = self._get_prefetch_data(path, offset, size)
             read_len = len(buf)
             if read_len + offset < sb.size:
                 self._invoke_prefetch(path, offset + read_len, size)
 
-            time2 = datetime.now()
-            delta = time2 - time1
-            logger.info("read: took - %s" % delta)
-            logger.info("read: read done")
+            if debug:
+                time2 = datetime.now()
+                delta = time2 - time1
+                logger.debug("read: took - %s", delta)
+                logger.debug("read: read done")
 
         except Exception, e:
             logger.error("read: " + traceback.format_exc())
@@ -516,20 +568,19 @@ class irods_client(object):
         return buf
 
     def write(self, path, offset, buf):
-        logger.info(
-            "write : %s, off(%d), size(%d)" %
-            (path, offset, len(buf)))
+        logger.debug(
+            "write : %s, off(%d), size(%d)", path, offset, len(buf))
         try:
             obj = None
             if self.exists(path):
-                logger.info("write: opening a file - %s" % path)
+                logger.debug("write: opening a file - %s", path)
                 obj = self.session.data_objects.get(path)
             else:
-                logger.info("write: creating a file - %s" % path)
+                logger.debug("write: creating a file - %s", path)
                 obj = self.session.data_objects.create(path)
             with obj.open('w') as f:
                 if offset != 0:
-                    logger.info("write: seeking at %d" % offset)
+                    logger.debug("write: seeking at %d", offset)
                     new_offset = f.seek(offset)
                     if new_offset != offset:
                         logger.error(
@@ -541,9 +592,9 @@ class irods_client(object):
                             "but returned(%d)" %
                             (offset, new_offset))
 
-                logger.info("write: writing buffer %d" % len(buf))
+                logger.debug("write: writing buffer %d", len(buf))
                 f.write(buf)
-                logger.info("write: writing done")
+                logger.debug("write: writing done")
 
         except Exception, e:
             logger.error("write: " + traceback.format_exc())
@@ -554,11 +605,11 @@ class irods_client(object):
         self.clear_stat_cache(path)
 
     def truncate(self, path, size):
-        logger.info("truncate : %s" % path)
+        logger.debug("truncate : %s", path)
         try:
-            logger.info("truncate: truncating a file - %s" % path)
+            logger.debug("truncate: truncating a file - %s", path)
             self.session.data_objects.truncate(path, size)
-            logger.info("truncate: truncating done")
+            logger.debug("truncate: truncating done")
 
         except Exception, e:
             logger.error("truncate: " + traceback.format_exc())
@@ -569,11 +620,11 @@ class irods_client(object):
         self.clear_stat_cache(path)
 
     def unlink(self, path):
-        logger.info("unlink : %s" % path)
+        logger.debug("unlink : %s", path)
         try:
-            logger.info("unlink: deleting a file - %s" % path)
+            logger.debug("unlink: deleting a file - %s", path)
             self.session.data_objects.unlink(path)
-            logger.info("unlink: deleting done")
+            logger.debug("unlink: deleting done")
 
         except Exception, e:
             logger.error("unlink: " + traceback.format_exc())
@@ -584,11 +635,11 @@ class irods_client(object):
         self.clear_stat_cache(path)
 
     def rename(self, path1, path2):
-        logger.info("rename : %s -> %s" % (path1, path2))
+        logger.debug("rename : %s -> %s", path1, path2)
         try:
-            logger.info("rename: renaming a file - %s to %s" % (path1, path2))
+            logger.debug("rename: renaming a file - %s to %s", path1, path2)
             self.session.data_objects.move(path1, path2)
-            logger.info("rename: renaming done")
+            logger.debug("rename: renaming done")
 
         except Exception, e:
             logger.error("rename: " + traceback.format_exc())
@@ -600,13 +651,13 @@ class irods_client(object):
         self.clear_stat_cache(path2)
 
     def set_xattr(self, path, key, value):
-        logger.info("set_xattr : %s - %s" % (key, value))
+        logger.debug("set_xattr : %s - %s", key, value)
         try:
-            logger.info(
-                "set_xattr: set extended attribute to a file %s %s=%s" %
-                (path, key, value))
+            logger.debug(
+                "set_xattr: set extended attribute to a file %s %s=%s",
+                path, key, value)
             self.session.metadata.set(DataObject, path, iRODSMeta(key, value))
-            logger.info("set_xattr: done")
+            logger.debug("set_xattr: done")
 
         except Exception, e:
             logger.error("set_xattr: " + traceback.format_exc())
@@ -614,18 +665,18 @@ class irods_client(object):
             raise e
 
     def get_xattr(self, path, key):
-        logger.info("get_xattr : " + key)
+        logger.debug("get_xattr : %s", key)
         value = None
         try:
-            logger.info(
-                "get_xattr: get extended attribute from a file - %s %s" %
-                (path, key))
+            logger.debug(
+                "get_xattr: get extended attribute from a file - %s %s",
+                path, key)
             attrs = self.session.metadata.get(DataObject, path)
             for attr in attrs:
                 if key == attr.name:
                     value = attr.value
                     break
-            logger.info("get_xattr: done")
+            logger.debug("get_xattr: done")
 
         except Exception, e:
             logger.error("get_xattr: " + traceback.format_exc())
@@ -635,16 +686,16 @@ class irods_client(object):
         return value
 
     def list_xattr(self, path):
-        logger.info("list_xattr : %s" % key)
+        logger.debug("list_xattr : %s", path)
         keys = []
         try:
-            logger.info(
-                "list_xattr: get extended attributes from a file - %s" %
+            logger.debug(
+                "list_xattr: get extended attributes from a file - %s",
                 path)
             attrs = self.session.metadata.get(DataObject, path)
             for attr in attrs:
                 keys.append(attr.name)
-            logger.info("list_xattr: done")
+            logger.debug("list_xattr: done")
 
         except Exception, e:
             logger.error("list_xattr: " + traceback.format_exc())
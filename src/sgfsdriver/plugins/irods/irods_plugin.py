@@ -21,21 +21,42 @@ General iRODS Plugin
 """
 import os
 import logging
-import threading
 import sgfsdriver.lib.abstractfs as abstractfs
 import sgfsdriver.plugins.irods.irods_client as irods_client
 
+from sgfsdriver.lib.pathutil import to_ascii, get_path_converter
+from sgfsdriver.lib.lockutil import sharded_lock
+from fastrlock.rlock import FastRLock
+
 logger = logging.getLogger('syndicate_iRODS_filesystem')
-logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('syndicate_iRODS_filesystem.log')
-fh.setLevel(logging.DEBUG)
-# create formatter and add it to the handlers
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
+# only warnings and errors are logged (to stderr) unless a log dir is
+# configured
+logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+sh.setLevel(logging.WARNING)
+sh.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(sh)
+
+
+def _configure_logger(log_dir):
+    if logger.level == logging.DEBUG:
+        # already configured
+        return
+
+    logger.setLevel(logging.DEBUG)
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(
+        os.path.join(log_dir, 'syndicate_iRODS_filesystem.log'))
+    fh.setLevel(logging.DEBUG)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(fh)
+
+    irods_client.configure_logger(log_dir)
 
 
 def reconnectAtIRODSFail(func):
@@ -43,16 +64,30 @@ def reconnectAtIRODSFail(func):
         try:
             return func(self, *args, **kwargs)
         except Exception as e:
-            logger.info("failed to process an operation : " + str(e))
+            logger.info("failed to process an operation : %s", e)
             if self.irods:
                 logger.info("reconnect: trying to reconnect to iRODS")
-                self.irods.reconnect()
+                # the session is shared by all shards
+                with self.locks:
+                    self.irods.reconnect()
                 logger.info("calling the operation again")
                 return func(self, *args, **kwargs)
 
     return wrap
 
 
+def _afsstat_from_irods_status(driver_path, sb):
+    return abstractfs.afsstat(
+        directory=sb.directory,
+        path=driver_path,
+        name=driver_path.rpartition("/")[2],
+        size=sb.size,
+        checksum=sb.checksum,
+        create_time=sb.create_time,
+        modify_time=sb.modify_time
+    )
+
+
 class plugin_impl(abstractfs.afsbase):
     def __init__(self, config, role=abstractfs.afsrole.DISCOVER):
         logger.info("__init__")
@@ -60,6 +95,11 @@ class plugin_impl(abstractfs.afsbase):
         if not config:
             raise ValueError("fs configuration is not given correctly")
 
+        # logging is disabled unless a log dir is given
+        log_dir = config.get("log_dir")
+        if log_dir:
+            _configure_logger(to_ascii(log_dir))
+
         work_root = config.get("work_root")
         if not work_root:
             raise ValueError("work_root configuration is not given correctly")
@@ -69,12 +109,12 @@ class plugin_impl(abstractfs.afsbase):
             raise ValueError("secrets are not given correctly")
 
         user = secrets.get("user")
-        user = user.encode('ascii', 'ignore')
+        user = to_ascii(user)
         if not user:
             raise ValueError("user is not given correctly")
 
         password = secrets.get("password")
-        password = password.encode('ascii', 'ignore')
+        password = to_ascii(password)
         if not password:
             raise ValueError("password is not given correctly")
 
@@ -86,8 +126,9 @@ class plugin_impl(abstractfs.afsbase):
         self._role = role
 
         # config can have unicode strings
-        work_root = work_root.encode('ascii', 'ignore')
+        work_root = to_ascii(work_root)
         self.work_root = work_root.rstrip("/")
+        self._path_converter = get_path_converter(self.work_root)
 
         self.irods_config = irods_config
 
@@ -95,9 +136,9 @@ class plugin_impl(abstractfs.afsbase):
         # we convert unicode (maybe) strings to ascii
         # since python-irodsclient cannot accept unicode strings
         irods_host = self.irods_config["host"]
-        irods_host = irods_host.encode('ascii', 'ignore')
+        irods_host = to_ascii(irods_host)
         irods_zone = self.irods_config["zone"]
-        irods_zone = irods_zone.encode('ascii', 'ignore')
+        irods_zone = to_ascii(irods_zone)
 
         logger.info("__init__: initializing irods_client")
         self.irods = irods_client.irods_client(
@@ -109,55 +150,65 @@ class plugin_impl(abstractfs.afsbase):
         )
 
         self.notification_cb = None
-        # create a re-entrant lock (not a read lock)
-        self.lock = threading.RLock()
-
-    def _lock(self):
-        self.lock.acquire()
-
-    def _unlock(self):
-        self.lock.release()
-
-    def _get_lock(self):
-        return self.lock
+        # locks are picked by the stat cache entry of irods_client that an
+        # operation fills or clears. a thread holding one of them must not
+        # lock all (e.g., by rename).
+        # operations under different shards share the iRODS session. this
+        # is safe since the session checks out a separate connection from
+        # its connection pool for each request (as the prefetch thread
+        # already does). reconnecting closes all connections, so it locks
+        # all shards
+        self.locks = sharded_lock()
+        # irods_client keeps a single prefetch thread, reads are serialized
+        self._read_lock = FastRLock()
+
+    def _lockfor(self, path):
+        # irods_client caches the stat of a path in the listing of its
+        # parent dir
+        return self.locks.lockfor(os.path.dirname(path))
+
+    def _lockfor_dir(self, dirpath):
+        # listing of the dir itself
+        return self.locks.lockfor(dirpath)
+
+    def _lockfor_clear(self, path):
+        # clearing the cache of a path drops either the listing of the path
+        # (if it is a dir) or the listing of its parent dir
+        return self.locks.locksfor(path, os.path.dirname(path))
 
     def on_update_detected(self, operation, path):
-        logger.info("on_update_detected - %s, %s" % (operation, path))
+        logger.debug("on_update_detected - %s, %s", operation, path)
 
-        ascii_path = path.encode('ascii', 'ignore')
+        ascii_path = to_ascii(path)
         driver_path = self._make_driver_path(ascii_path)
 
-        self.clear_cache(driver_path)
-        if operation == "remove":
-            if self.notification_cb:
+        if operation in ["create", "modify"] and self.notification_cb:
+            # clears the cached stat and fetches a new one at once
+            irods_path = self._make_irods_path(ascii_path)
+            sb = self._refresh_stat(irods_path)
+            if sb:
+                st = _afsstat_from_irods_status(driver_path, sb)
+                entry = abstractfs.afsevent(driver_path, st)
+                if operation == "create":
+                    self.notification_cb([], [entry], [])
+                elif operation == "modify":
+                    self.notification_cb([entry], [], [])
+        else:
+            self.clear_cache(driver_path)
+            if operation == "remove" and self.notification_cb:
                 entry = abstractfs.afsevent(driver_path, None)
                 self.notification_cb([], [], [entry])
-        elif operation in ["create", "modify"]:
-            if self.notification_cb:
-                sb = self.stat(driver_path)
-                if sb:
-                    entry = abstractfs.afsevent(driver_path, sb)
-                    if operation == "create":
-                        self.notification_cb([], [entry], [])
-                    elif operation == "modify":
-                        self.notification_cb([entry], [], [])
 
-    def _make_irods_path(self, path):
-        if path.startswith(self.work_root):
-            if path == "/":
-                return path
-            else:
-                return path.rstrip("/")
-
-        if path.startswith("/"):
-            return self.work_root + path.rstrip("/")
+    @reconnectAtIRODSFail
+    def _refresh_stat(self, irods_path):
+        with self._lockfor_clear(irods_path):
+            return self.irods.refresh_stat(irods_path)
 
-        return self.work_root + "/" + path.rstrip("/")
+    def _make_irods_path(self, path):
+        return self._path_converter.sub_path(path)
 
     def _make_driver_path(self, path):
-        if path.startswith(self.work_root):
-            return path[len(self.work_root):].rstrip("/")
-        return path.rstrip("/")
+        return self._path_converter.driver_path(path)
 
     def connect(self):
         logger.info("connect: connecting to iRODS")
@@ -176,152 +227,166 @@ class plugin_impl(abstractfs.afsbase):
 
     @reconnectAtIRODSFail
     def stat(self, path):
-        logger.info("stat - %s" % path)
+        logger.debug("stat - %s", path)
 
-        with self._get_lock():
-            ascii_path = path.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
-            driver_path = self._make_driver_path(ascii_path)
+        ascii_path = to_ascii(path)
+        irods_path = self._make_irods_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor(irods_path):
             # get stat
             sb = self.irods.stat(irods_path)
-            if sb:
-                return abstractfs.afsstat(
-                    directory=sb.directory,
-                    path=driver_path,
-                    name=os.path.basename(driver_path),
-                    size=sb.size,
-                    checksum=sb.checksum,
-                    create_time=sb.create_time,
-                    modify_time=sb.modify_time
-                )
-            else:
-                return None
+
+        if sb:
+            return _afsstat_from_irods_status(driver_path, sb)
+        else:
+            return None
 
     @reconnectAtIRODSFail
     def exists(self, path):
-        logger.info("exists - %s" % path)
+        logger.debug("exists - %s", path)
 
-        with self._get_lock():
-            ascii_path = path.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(path)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             exist = self.irods.exists(irods_path)
             return exist
 
     @reconnectAtIRODSFail
     def list_dir(self, dirpath):
-        logger.info("list_dir - %s" % dirpath)
+        logger.debug("list_dir - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(dirpath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor_dir(irods_path):
             l = self.irods.list_dir(irods_path)
             return l
 
+    @reconnectAtIRODSFail
+    def list_dir_stat(self, dirpath):
+        logger.debug("list_dir_stat - %s", dirpath)
+
+        ascii_path = to_ascii(dirpath)
+        irods_path = self._make_irods_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor_dir(irods_path):
+            sbs = self.irods.list_dir_stat(irods_path)
+
+        entries = []
+        for sb in sbs:
+            entry_path = driver_path + "/" + sb.name
+            entries.append(
+                (sb.name, _afsstat_from_irods_status(entry_path, sb)))
+        return entries
+
     @reconnectAtIRODSFail
     def is_dir(self, dirpath):
-        logger.info("is_dir - %s" % dirpath)
+        logger.debug("is_dir - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(dirpath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             d = self.irods.is_dir(irods_path)
             return d
 
     @reconnectAtIRODSFail
     def make_dirs(self, dirpath):
-        logger.info("make_dirs - %s" % dirpath)
+        logger.debug("make_dirs - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(dirpath)
+        irods_path = self._make_irods_path(ascii_path)
+        # ancestors are checked and created as well
+        with self.locks:
             if not self.exists(irods_path):
                 self.irods.make_dirs(irods_path)
 
     @reconnectAtIRODSFail
     def read(self, filepath, offset, size):
-        logger.info("read - %s, %d, %d" % (filepath, offset, size))
+        logger.debug("read - %s, %d, %d", filepath, offset, size)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path), self._read_lock:
             buf = self.irods.read(irods_path, offset, size)
             return buf
 
     @reconnectAtIRODSFail
     def write(self, filepath, offset, buf):
-        logger.info("write - %s, %d, %d" % (filepath, offset, len(buf)))
+        logger.debug("write - %s, %d, %d", filepath, offset, len(buf))
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             self.irods.write(irods_path, offset, buf)
 
     @reconnectAtIRODSFail
     def truncate(self, filepath, size):
-        logger.info("truncate - %s, %d" % (filepath, size))
+        logger.debug("truncate - %s, %d", filepath, size)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             self.irods.truncate(irods_path, size)
 
     @reconnectAtIRODSFail
     def clear_cache(self, path):
-        logger.info("clear_cache - %s" % path)
+        logger.debug("clear_cache - %s", path)
 
-        with self._get_lock():
-            if path:
-                ascii_path = path.encode('ascii', 'ignore')
-                irods_path = self._make_irods_path(ascii_path)
+        if path:
+            ascii_path = to_ascii(path)
+            irods_path = self._make_irods_path(ascii_path)
+            with self._lockfor_clear(irods_path):
                 self.irods.clear_stat_cache(irods_path)
-            else:
+        elif not self.irods.is_stat_cache_empty():
+            # skips locking if there is nothing to clear
+            with self.locks:
                 self.irods.clear_stat_cache(None)
 
     @reconnectAtIRODSFail
     def unlink(self, filepath):
-        logger.info("unlink - %s" % filepath)
+        logger.debug("unlink - %s", filepath)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             self.irods.unlink(irods_path)
 
     @reconnectAtIRODSFail
     def rename(self, filepath1, filepath2):
-        logger.info("rename - %s to %s" % (filepath1, filepath2))
-
-        with self._get_lock():
-            ascii_path1 = filepath1.encode('ascii', 'ignore')
-            ascii_path2 = filepath2.encode('ascii', 'ignore')
-            irods_path1 = self._make_irods_path(ascii_path1)
-            irods_path2 = self._make_irods_path(ascii_path2)
+        logger.debug("rename - %s to %s", filepath1, filepath2)
+
+        ascii_path1 = to_ascii(filepath1)
+        ascii_path2 = to_ascii(filepath2)
+        irods_path1 = self._make_irods_path(ascii_path1)
+        irods_path2 = self._make_irods_path(ascii_path2)
+        # entries under a renamed collection are also affected
+        with self.locks:
             self.irods.rename(irods_path1, irods_path2)
 
     @reconnectAtIRODSFail
     def set_xattr(self, filepath, key, value):
-        logger.info("set_xattr - %s, %s=%s" % (filepath, key, value))
+        logger.debug("set_xattr - %s, %s=%s", filepath, key, value)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             self.irods.set_xattr(irods_path, key, value)
 
     @reconnectAtIRODSFail
     def get_xattr(self, filepath, key):
-        logger.info("get_xattr - %s, %s" % (filepath, key))
+        logger.debug("get_xattr - %s, %s", filepath, key)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            irods_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        irods_path = self._make_irods_path(ascii_path)
+        with self._lockfor(irods_path):
             return self.irods.get_xattr(irods_path, key)
 
     @reconnectAtIRODSFail
     def list_xattr(self, filepath):
-        logger.info("list_xattr - %s" % filepath)
+        logger.debug("list_xattr - %s", filepath)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_irods_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_irods_path(ascii_path)
+        with self._lockfor(localfs_path):
             return self.irods.list_xattr(localfs_path)
 
     def plugin(self):
@@ -20,8 +20,10 @@
 Local-filesystem Plugin
 """
 import os
+import errno
 import xattr
 import stat
+import time
 import logging
 import threading
 import pyinotify
@@ -29,50 +31,167 @@ import pyinotify
 
 import sgfsdriver.lib.abstractfs as abstractfs
 
+try:
+    from os import scandir
+except ImportError:
+    # python 2
+    from scandir import scandir
+
+from sgfsdriver.lib.pathutil import to_ascii, get_path_converter
+from sgfsdriver.lib.lockutil import sharded_lock
+from fastrlock.rlock import FastRLock
+
+STAT_CACHE_SIZE = 10000
+STAT_CACHE_TTL = 1     # 1 sec
+
+FD_CACHE_SIZE = 128   # split among lock shards
+FD_CACHE_TTL = 1     # 1 sec
+
+INOTIFY_POLL_TIMEOUT = 1000     # 1 sec
+INOTIFY_COALESCE_WINDOW = 50    # 50 ms
+INOTIFY_BATCH_SIZE = 32
+
+# entries stat'ed under the same locks by list_dir_stat
+LIST_DIR_STAT_BATCH_SIZE = 16
+
 logger = logging.getLogger('syndicate_local_filesystem')
-logger.setLevel(logging.DEBUG)
-# create file handler which logs even debug messages
-fh = logging.FileHandler('syndicate_local_filesystem.log')
-fh.setLevel(logging.DEBUG)
-# create formatter and add it to the handlers
-formatter = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-# add the handlers to the logger
-logger.addHandler(fh)
+# only warnings and errors are logged (to stderr) unless a log dir is
+# configured
+logger.setLevel(logging.WARNING)
+sh = logging.StreamHandler()
+sh.setLevel(logging.WARNING)
+sh.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(sh)
+
+
+def _configure_logger(log_dir):
+    if logger.level == logging.DEBUG:
+        # already configured
+        return
+
+    logger.setLevel(logging.DEBUG)
+    # create file handler which logs even debug messages
+    fh = logging.FileHandler(
+        os.path.join(log_dir, 'syndicate_local_filesystem.log'))
+    fh.setLevel(logging.DEBUG)
+    # create formatter and add it to the handlers
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    fh.setFormatter(formatter)
+    # add the handlers to the logger
+    logger.addHandler(fh)
+
+
+def _afsstat_from_sb(driver_path, sb):
+    return abstractfs.afsstat(
+        directory=stat.S_ISDIR(sb.st_mode),
+        symlink=stat.S_ISLNK(sb.st_mode),
+        path=driver_path,
+        name=driver_path.rpartition("/")[2],
+        size=sb.st_size,
+        checksum=0,
+        create_time=sb.st_ctime,
+        modify_time=sb.st_mtime
+    )
 
 
 class InotifyEventHandler(pyinotify.ProcessEvent):
     def __init__(self, plugin):
         self.plugin = plugin
+        # events read but not yet delivered to the plugin
+        self.pending = []
+        # last pending operation of a path (pathname -> operation)
+        self._recent = {}
+
+    def _add_pending(self, operation, pathname):
+        prev_operation = self._recent.get(pathname)
+        if prev_operation == operation or \
+                (prev_operation == "create" and operation == "modify"):
+            # duplicate, the pending one will stat the latest state
+            return
+        self._recent[pathname] = operation
+        self.pending.append((operation, pathname))
+
+    def take_pending(self):
+        events = self.pending
+        self.pending = []
+        self._recent = {}
+        return events
 
     def process_IN_CREATE(self, event):
-        logger.info("Creating: %s" % event.pathname)
-        self.plugin.on_update_detected("create", event.pathname)
+        logger.debug("Creating: %s", event.pathname)
+        self._add_pending("create", event.pathname)
 
     def process_IN_DELETE(self, event):
-        logger.info("Removing: %s" % event.pathname)
-        self.plugin.on_update_detected("remove", event.pathname)
+        logger.debug("Removing: %s", event.pathname)
+        self._add_pending("remove", event.pathname)
 
     def process_IN_MODIFY(self, event):
-        logger.info("Modifying: %s" % event.pathname)
-        self.plugin.on_update_detected("modify", event.pathname)
+        logger.debug("Modifying: %s", event.pathname)
+        self._add_pending("modify", event.pathname)
 
     def process_IN_ATTRIB(self, event):
-        logger.info("Modifying attributes: %s" % event.pathname)
-        self.plugin.on_update_detected("modify", event.pathname)
+        logger.debug("Modifying attributes: %s", event.pathname)
+        self._add_pending("modify", event.pathname)
 
     def process_IN_MOVED_FROM(self, event):
-        logger.info("Moving a file from : %s" % event.pathname)
-        self.plugin.on_update_detected("remove", event.pathname)
+        logger.debug("Moving a file from : %s", event.pathname)
+        self._add_pending("remove", event.pathname)
 
     def process_IN_MOVED_TO(self, event):
-        logger.info("Moving a file to : %s" % event.pathname)
-        self.plugin.on_update_detected("create", event.pathname)
+        logger.debug("Moving a file to : %s", event.pathname)
+        self._add_pending("create", event.pathname)
 
     def process_default(self, event):
-        logger.info("Unhandled event to a file : %s" % event.pathname)
-        logger.info("- %s" % event)
+        logger.debug("Unhandled event to a file : %s", event.pathname)
+        logger.debug("- %s", event)
+
+
+class InotifyNotifierThread(threading.Thread):
+    """
+    Reads inotify events and delivers them to the plugin in batches.
+    Events are collected for a short window so that a burst on the same
+    paths (e.g., a file being written) is delivered once.
+    """
+    def __init__(self, plugin, watch_manager, notify_handler):
+        threading.Thread.__init__(self, name="inotify_notifier_thread")
+        self.daemon = True
+        self.plugin = plugin
+        self.notify_handler = notify_handler
+        self.notifier = pyinotify.Notifier(watch_manager, notify_handler)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if self.notifier.check_events(timeout=INOTIFY_POLL_TIMEOUT):
+                    self.notifier.read_events()
+                    self.notifier.process_events()
+                    self._collect_events(INOTIFY_COALESCE_WINDOW)
+                    events = self.notify_handler.take_pending()
+                    if events:
+                        self.plugin.on_updates_detected(events)
+        finally:
+            self.notifier.stop()
+
+    def _collect_events(self, window):
+        # window is in ms, as for check_events
+        deadline = time.time() + window / 1000.0
+        while not self._stop_event.is_set():
+            timeout = int((deadline - time.time()) * 1000)
+            if timeout <= 0 or not self.notifier.check_events(timeout=timeout):
+                break
+            self.notifier.read_events()
+            self.notifier.process_events()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.ident is None:
+            # never started
+            self.notifier.stop()
+        else:
+            self.join()
 
 
 class plugin_impl(abstractfs.afsbase):
@@ -82,6 +201,11 @@ class plugin_impl(abstractfs.afsbase):
         if not config:
             raise ValueError("fs configuration is not given correctly")
 
+        # logging is disabled unless a log dir is given
+        log_dir = config.get("log_dir")
+        if log_dir:
+            _configure_logger(to_ascii(log_dir))
+
         work_root = config.get("work_root")
         if not work_root:
             raise ValueError("work_root configuration is not given correctly")
@@ -90,67 +214,109 @@ class plugin_impl(abstractfs.afsbase):
         self._role = role
 
         # config can have unicode strings
-        work_root = work_root.encode('ascii', 'ignore')
+        work_root = to_ascii(work_root)
         self.work_root = work_root.rstrip("/")
+        self._path_converter = get_path_converter(self.work_root)
+
+        # cache of stats (driver path -> (expire, afsstat or None if not
+        # exist)). readers need no lock since a dict get, set or pop is
+        # atomic under the GIL; writers are serialized by the writer lock
+        self._stat_cache = {}
+        self._stat_cache_writer_lock = FastRLock()
+
+        # locks are picked by localfs path. a thread holding one of them
+        # must not lock all (e.g., by rename)
+        self.locks = sharded_lock()
+
+        # caches of file descriptors for read, one per lock shard
+        # (localfs path -> (fd, expire))
+        self._fd_caches = [{} for _ in range(len(self.locks))]
+        self._fd_cache_size = max(1, FD_CACHE_SIZE // len(self.locks))
 
         if self._role == abstractfs.afsrole.DISCOVER:
             # set inotify
             self.watch_manager = pyinotify.WatchManager()
             self.notify_handler = InotifyEventHandler(self)
-            self.notifier = pyinotify.ThreadedNotifier(
+            self.notifier = InotifyNotifierThread(
+                self,
                 self.watch_manager,
                 self.notify_handler
             )
 
         self.notification_cb = None
-        # create a re-entrant lock (not a read lock)
-        self.lock = threading.RLock()
 
-    def _lock(self):
-        self.lock.acquire()
-
-    def _unlock(self):
-        self.lock.release()
-
-    def _get_lock(self):
-        return self.lock
+    def _lockfor(self, path):
+        return self.locks.lockfor(path)
 
     def on_update_detected(self, operation, path):
-        logger.info("on_update_detected - %s, %s" % (operation, path))
+        logger.debug("on_update_detected - %s, %s", operation, path)
 
-        ascii_path = path.encode('ascii', 'ignore')
-        driver_path = self._make_driver_path(ascii_path)
+        self.on_updates_detected([(operation, path)])
 
-        self.clear_cache(driver_path)
-        if operation == "remove":
-            if self.notification_cb:
-                entry = abstractfs.afsevent(driver_path, None)
-                self.notification_cb([], [], [entry])
-        elif operation in ["create", "modify"]:
-            if self.notification_cb:
-                st = self.stat(driver_path)
-                entry = abstractfs.afsevent(driver_path, st)
-                if operation == "create":
-                    self.notification_cb([], [entry], [])
-                elif operation == "modify":
-                    self.notification_cb([entry], [], [])
+    def on_updates_detected(self, events):
+        logger.debug("on_updates_detected - %d events", len(events))
 
-    def _make_localfs_path(self, path):
-        if path.startswith(self.work_root):
-            if path == "/":
-                return path
-            else:
-                return path.rstrip("/")
-
-        if path.startswith("/"):
-            return self.work_root + path.rstrip("/")
+        # coalesce events on the same path, the last operation wins.
+        # a path is ordered by its last operation, so that e.g. a re-created
+        # dir comes before the entries created in it
+        operations = {}
+        positions = {}
+        for position, (operation, path) in enumerate(events):
+            ascii_path = to_ascii(path)
+            driver_path = self._make_driver_path(ascii_path)
+            prev_operation = operations.get(driver_path)
+            if prev_operation == operation or \
+                    (prev_operation == "create" and operation == "modify"):
+                # a duplicate, or still a new entry to the receiver
+                continue
+            operations[driver_path] = operation
+            positions[driver_path] = position
+
+        driver_paths = sorted(operations, key=positions.get)
+
+        for i in range(0, len(driver_paths), INOTIFY_BATCH_SIZE):
+            updated = []
+            added = []
+            removed = []
+            stats = []
+            batch = driver_paths[i:i + INOTIFY_BATCH_SIZE]
+            localfs_paths = [self._make_localfs_path(p) for p in batch]
+            with self.locks.locksfor(*localfs_paths):
+                for driver_path, localfs_path in zip(batch, localfs_paths):
+                    operation = operations[driver_path]
+                    self._close_read_fd(localfs_path)
+                    if operation == "remove":
+                        # no need to stat
+                        st = None
+                    else:
+                        st = self._stat_uncached(localfs_path, driver_path)
+                    # replaces the cached stat
+                    stats.append((driver_path, st))
+
+                    if operation == "remove":
+                        removed.append(abstractfs.afsevent(driver_path, None))
+                    elif operation in ["create", "modify"]:
+                        if st is None:
+                            # removed already, a remove event will follow
+                            continue
+
+                        entry = abstractfs.afsevent(driver_path, st)
+                        if operation == "create":
+                            added.append(entry)
+                        else:
+                            updated.append(entry)
+
+                # published with the locks held, see _cache_stats
+                self._cache_stats(stats)
+
+            if self.notification_cb and (updated or added or removed):
+                self.notification_cb(updated, added, removed)
 
-        return self.work_root + "/" + path.rstrip("/")
+    def _make_localfs_path(self, path):
+        return self._path_converter.sub_path(path)
 
     def _make_driver_path(self, path):
-        if path.startswith(self.work_root):
-            return path[len(self.work_root):].rstrip("/")
-        return path.rstrip("/")
+        return self._path_converter.driver_path(path)
 
     def connect(self):
         logger.info("connect")
@@ -188,140 +354,316 @@ class plugin_impl(abstractfs.afsbase):
             if self.notifier:
                 self.notifier.stop()
 
+        with self.locks:
+            self._close_read_fd(None)
+
+    def _get_stat(self, localfs_path, driver_path):
+        # returns None if the path does not exist
+        entry = self._stat_cache.get(driver_path)
+        if entry and time.time() < entry[0]:
+            return entry[1]
+
+        with self._lockfor(localfs_path):
+            st = self._stat_uncached(localfs_path, driver_path)
+            self._cache_stats([(driver_path, st)])
+        return st
+
+    def _stat_uncached(self, localfs_path, driver_path):
+        # returns None if the path does not exist
+        try:
+            with self._lockfor(localfs_path):
+                sb = os.stat(localfs_path)
+        except OSError as e:
+            if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+                raise
+            return None
+        return _afsstat_from_sb(driver_path, sb)
+
+    def _cache_stats(self, stats):
+        # stats is a list of (driver path, afsstat or None).
+        # must be called with the locks for the paths held, from before the
+        # stats were taken. otherwise an invalidation by a concurrent write
+        # can be overwritten with a stat taken before the write
+        now = time.time()
+        expire = now + STAT_CACHE_TTL
+        with self._stat_cache_writer_lock:
+            cache = self._stat_cache
+            if len(cache) + len(stats) > STAT_CACHE_SIZE:
+                self._compact_stat_cache(now, len(stats))
+
+            for driver_path, st in stats:
+                # existing entries are always replaced, new entries are
+                # skipped if stats do not fit even after compaction
+                if driver_path in cache or len(cache) < STAT_CACHE_SIZE:
+                    cache[driver_path] = (expire, st)
+
+    def _compact_stat_cache(self, now, room):
+        # must be called with the writer lock held.
+        # drops expired entries, then arbitrary entries if still full.
+        # frees an eighth of the cache at least, so this is not repeated
+        # on every insert
+        cache = self._stat_cache
+        for driver_path, entry in cache.items():
+            if entry[0] <= now:
+                del cache[driver_path]
+
+        max_len = max(0, min(STAT_CACHE_SIZE - room,
+                             STAT_CACHE_SIZE - STAT_CACHE_SIZE // 8))
+        while cache and len(cache) > max_len:
+            cache.popitem()
+
+    def _invalidate_stat(self, driver_path):
+        if driver_path not in self._stat_cache:
+            return
+
+        with self._stat_cache_writer_lock:
+            self._stat_cache.pop(driver_path, None)
+
+    def _clear_stat_cache(self):
+        with self._stat_cache_writer_lock:
+            self._stat_cache.clear()
+
+    def _get_read_fd(self, localfs_path):
+        # must be called with the lock for localfs_path held.
+        # evicts only fds in the same shard, as other shards may be in use
+        now = time.time()
+        fd_cache = self._fd_caches[self.locks.shard(localfs_path)]
+        entry = fd_cache.get(localfs_path)
+        if entry:
+            fd, expire = entry
+            if now < expire:
+                return fd
+            # file may have been replaced
+            del fd_cache[localfs_path]
+            os.close(fd)
+
+        fd = os.open(localfs_path, os.O_RDONLY)
+        if len(fd_cache) >= self._fd_cache_size:
+            _, (old_fd, _) = fd_cache.popitem()
+            os.close(old_fd)
+        fd_cache[localfs_path] = (fd, now + FD_CACHE_TTL)
+        return fd
+
+    def _close_read_fd(self, localfs_path):
+        # must be called with the lock for localfs_path held,
+        # or all locks if localfs_path is None
+        if localfs_path:
+            fd_cache = self._fd_caches[self.locks.shard(localfs_path)]
+            entry = fd_cache.pop(localfs_path, None)
+            if entry:
+                os.close(entry[0])
+        else:
+            for fd_cache in self._fd_caches:
+                for fd, _ in fd_cache.values():
+                    os.close(fd)
+                fd_cache.clear()
+
     def stat(self, path):
-        logger.info("stat - %s" % path)
+        logger.debug("stat - %s", path)
 
-        with self._get_lock():
-            ascii_path = path.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
-            driver_path = self._make_driver_path(ascii_path)
-            # get stat
-            sb = os.stat(localfs_path)
-            return abstractfs.afsstat(
-                directory=stat.S_ISDIR(sb.st_mode),
-                symlink=stat.S_ISLNK(sb.st_mode),
-                path=driver_path,
-                name=os.path.basename(driver_path),
-                size=sb.st_size,
-                checksum=0,
-                create_time=sb.st_ctime,
-                modify_time=sb.st_mtime
-            )
+        ascii_path = to_ascii(path)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        # get stat
+        st = self._get_stat(localfs_path, driver_path)
+        if st is None:
+            raise OSError(
+                errno.ENOENT, os.strerror(errno.ENOENT), localfs_path)
+        return st
 
     def exists(self, path):
-        logger.info("exists - %s" % path)
+        logger.debug("exists - %s", path)
 
-        with self._get_lock():
-            ascii_path = path.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
-            exist = os.path.exists(localfs_path)
-            return exist
+        ascii_path = to_ascii(path)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        try:
+            st = self._get_stat(localfs_path, driver_path)
+        except OSError:
+            return False
+        return st is not None
 
     def list_dir(self, dirpath):
-        logger.info("list_dir - %s" % dirpath)
+        logger.debug("list_dir - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(dirpath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
             l = os.listdir(localfs_path)
             return l
 
+    def list_dir_stat(self, dirpath):
+        logger.debug("list_dir_stat - %s", dirpath)
+
+        ascii_path = to_ascii(dirpath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor(localfs_path):
+            dentries = list(scandir(localfs_path))
+
+        entries = []
+        # stat and cache in small batches, each under the locks of its
+        # entries only, so other paths are not blocked for the whole scan
+        for i in range(0, len(dentries), LIST_DIR_STAT_BATCH_SIZE):
+            batch = dentries[i:i + LIST_DIR_STAT_BATCH_SIZE]
+            entry_paths = [driver_path + "/" + d.name for d in batch]
+            entry_localfs_paths = [
+                self._make_localfs_path(p) for p in entry_paths]
+            stats = []
+            with self.locks.locksfor(*entry_localfs_paths):
+                for dentry, entry_path in zip(batch, entry_paths):
+                    try:
+                        sb = dentry.stat()
+                    except OSError as e:
+                        # removed while listing
+                        if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+                            raise
+                        continue
+
+                    st = _afsstat_from_sb(entry_path, sb)
+                    stats.append((entry_path, st))
+                    entries.append((dentry.name, st))
+
+                self._cache_stats(stats)
+        return entries
+
     def is_dir(self, dirpath):
-        logger.info("is_dir - %s" % dirpath)
+        logger.debug("is_dir - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
-            d = False
-            if os.path.exists(localfs_path):
-                sb = os.stat(localfs_path)
-                d = stat.S_ISDIR(sb.st_mode)
-            return d
+        ascii_path = to_ascii(dirpath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        try:
+            st = self._get_stat(localfs_path, driver_path)
+        except OSError:
+            return False
+        return st is not None and st.directory
 
     def make_dirs(self, dirpath):
-        logger.info("make_dirs - %s" % dirpath)
+        logger.debug("make_dirs - %s", dirpath)
 
-        with self._get_lock():
-            ascii_path = dirpath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(dirpath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
             if not os.path.exists(localfs_path):
                 os.makedirs(localfs_path)
+                # parent dirs may also have been created
+                self._clear_stat_cache()
 
     def read(self, filepath, offset, size):
-        logger.info("read - %s, %d, %d" % (filepath, offset, size))
+        logger.debug("read - %s, %d, %d", filepath, offset, size)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
-            with open(localfs_path, "r") as f:
-                f.seek(offset, 0)
-                buf = f.read(size)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
+            fd = self._get_read_fd(localfs_path)
+            os.lseek(fd, offset, os.SEEK_SET)
+            # os.read fills the returned string directly. a pooled buffer
+            # would need an extra copy since callers (e.g., AG data cache)
+            # keep the returned data, so buffers cannot be reused
+            buf = os.read(fd, size)
+            if 0 < len(buf) < size:
+                # short read
+                bufs = [buf]
+                read_len = len(buf)
+                while read_len < size:
+                    buf = os.read(fd, size - read_len)
+                    if not buf:
+                        break
+                    bufs.append(buf)
+                    read_len += len(buf)
+                buf = "".join(bufs)
             return buf
 
     def write(self, filepath, offset, buf):
-        logger.info("write - %s, %d, %d" % (filepath, offset, len(buf)))
+        logger.debug("write - %s, %d, %d", filepath, offset, len(buf))
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor(localfs_path):
             fd = os.open(localfs_path, os.O_WRONLY | os.O_CREAT)
             os.lseek(fd, offset, os.SEEK_SET)
             os.write(fd, buf)
             os.close(fd)
+            self._invalidate_stat(driver_path)
 
     def truncate(self, filepath, size):
-        logger.info("truncate - %s, %d" % (filepath, size))
+        logger.debug("truncate - %s, %d", filepath, size)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor(localfs_path):
             fd = os.open(localfs_path, os.O_WRONLY | os.O_CREAT)
             os.ftruncate(fd, size)
             os.close(fd)
+            self._invalidate_stat(driver_path)
 
     def clear_cache(self, path):
-        logger.info("clear_cache - %s" % path)
+        logger.debug("clear_cache - %s", path)
+
+        if path:
+            ascii_path = to_ascii(path)
+            localfs_path = self._make_localfs_path(ascii_path)
+            with self._lockfor(localfs_path):
+                self._invalidate_stat(self._make_driver_path(ascii_path))
+                self._close_read_fd(localfs_path)
+        else:
+            if not self._stat_cache and not any(self._fd_caches):
+                # nothing to clear, avoid locking all
+                return
+
+            with self.locks:
+                self._clear_stat_cache()
+                self._close_read_fd(None)
 
     def unlink(self, filepath):
-        logger.info("unlink - %s" % filepath)
+        logger.debug("unlink - %s", filepath)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        driver_path = self._make_driver_path(ascii_path)
+        with self._lockfor(localfs_path):
             os.unlink(localfs_path)
+            self._invalidate_stat(driver_path)
+            self._close_read_fd(localfs_path)
 
     def rename(self, filepath1, filepath2):
-        logger.info("rename - %s to %s" % (filepath1, filepath2))
-
-        with self._get_lock():
-            ascii_path1 = filepath1.encode('ascii', 'ignore')
-            ascii_path2 = filepath2.encode('ascii', 'ignore')
-            localfs_path1 = self._make_localfs_path(ascii_path1)
-            localfs_path2 = self._make_localfs_path(ascii_path2)
+        logger.debug("rename - %s to %s", filepath1, filepath2)
+
+        ascii_path1 = to_ascii(filepath1)
+        ascii_path2 = to_ascii(filepath2)
+        localfs_path1 = self._make_localfs_path(ascii_path1)
+        localfs_path2 = self._make_localfs_path(ascii_path2)
+        # entries under a renamed directory are also affected
+        with self.locks:
             os.rename(localfs_path1, localfs_path2)
+            self._clear_stat_cache()
+            self._close_read_fd(None)
 
     def set_xattr(self, filepath, key, value):
-        logger.info("set_xattr - %s, %s=%s" % (filepath, key, value))
+        logger.debug("set_xattr - %s, %s=%s", filepath, key, value)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
             xattr.setxattr(localfs_path, key, value)
 
     def get_xattr(self, filepath, key):
-        logger.info("get_xattr - %s, %s" % (filepath, key))
+        logger.debug("get_xattr - %s, %s", filepath, key)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
             return xattr.getxattr(localfs_path, key)
 
     def list_xattr(self, filepath):
-        logger.info("list_xattr - %s" % filepath)
+        logger.debug("list_xattr - %s", filepath)
 
-        with self._get_lock():
-            ascii_path = filepath.encode('ascii', 'ignore')
-            localfs_path = self._make_localfs_path(ascii_path)
+        ascii_path = to_ascii(filepath)
+        localfs_path = self._make_localfs_path(ascii_path)
+        with self._lockfor(localfs_path):
             return xattr.listxattr(localfs_path)
 
     def plugin(self):
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+   Copyright 2016 The Trustees of University of Arizona
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Local plugin update event test
+"""
+
+import traceback
+import os
+import sys
+import shutil
+import tempfile
+
+# import packages under src/
+test_dirpath = os.path.dirname(os.path.abspath(__file__))
+driver_root = os.path.dirname(test_dirpath)
+src_root = os.path.join(driver_root, "src")
+sys.path.append(src_root)
+
+import sgfsdriver.lib.abstractfs as abstractfs
+import sgfsdriver.plugins.local.local_plugin as local_plugin
+
+
+class EventTestException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def check(cond, msg):
+    if not cond:
+        raise EventTestException(msg)
+
+
+def deliver(fs, work_root, events):
+    """
+    delivers events to the plugin and returns (updated, added, removed)
+    as lists of driver paths
+    """
+    results = ([], [], [])
+
+    def notification_cb(updated, added, removed):
+        for result, entries in zip(results, [updated, added, removed]):
+            result.extend([entry.path for entry in entries])
+
+    fs.set_notification_cb(notification_cb)
+    fs.on_updates_detected([
+        (operation, os.path.join(work_root, path))
+        for operation, path in events
+    ])
+    fs.set_notification_cb(None)
+    return results
+
+
+def test_recreated_dir_order(fs, work_root):
+    """
+    a re-created dir must be delivered before the entries created in it
+    """
+    os.mkdir(os.path.join(work_root, "a"))
+    with open(os.path.join(work_root, "a", "f"), "w") as f:
+        f.write("data")
+
+    updated, added, removed = deliver(fs, work_root, [
+        ("remove", "a/f"),
+        ("remove", "a"),
+        ("create", "a"),
+        ("create", "a/f")
+    ])
+    check(added == ["/a", "/a/f"], "wrong order of added - %s" % added)
+    check(not updated and not removed, "unexpected updated or removed")
+
+
+def test_coalesce(fs, work_root):
+    """
+    events on the same path are delivered once, with the last operation
+    """
+    with open(os.path.join(work_root, "g"), "w") as f:
+        f.write("data")
+
+    updated, added, removed = deliver(fs, work_root, [
+        ("create", "g"),
+        ("modify", "g"),
+        ("modify", "g"),
+        ("modify", "a/f"),
+        ("remove", "h"),
+        ("remove", "h")
+    ])
+    check(added == ["/g"], "wrong added - %s" % added)
+    check(updated == ["/a/f"], "wrong updated - %s" % updated)
+    check(removed == ["/h"], "wrong removed - %s" % removed)
+
+
+class fake_event(object):
+    def __init__(self, pathname):
+        self.pathname = pathname
+
+
+def test_handler_coalesce(fs, work_root):
+    """
+    duplicate inotify events are dropped before they are delivered
+    """
+    handler = local_plugin.InotifyEventHandler(fs)
+    handler.process_IN_CREATE(fake_event("/x"))
+    handler.process_IN_MODIFY(fake_event("/x"))
+    handler.process_IN_MODIFY(fake_event("/y"))
+    handler.process_IN_ATTRIB(fake_event("/y"))
+    handler.process_IN_DELETE(fake_event("/y"))
+    handler.process_IN_MOVED_TO(fake_event("/y"))
+    handler.process_IN_MODIFY(fake_event("/y"))
+
+    pending = handler.take_pending()
+    check(pending == [
+        ("create", "/x"),
+        ("modify", "/y"),
+        ("remove", "/y"),
+        ("create", "/y")
+    ], "wrong pending events - %s" % pending)
+
+    # a new window starts after the pending events are taken
+    handler.process_IN_MODIFY(fake_event("/x"))
+    pending = handler.take_pending()
+    check(pending == [("modify", "/x")],
+          "wrong pending events - %s" % pending)
+
+
+def main():
+    work_root = tempfile.mkdtemp()
+    fs = local_plugin.plugin_impl(
+        {"work_root": work_root},
+        abstractfs.afsrole.WRITE
+    )
+    try:
+        fs.connect()
+        for test in [test_recreated_dir_order, test_coalesce,
+                     test_handler_coalesce]:
+            print "start test (%s)!" % test.__name__
+            test(fs, work_root)
+            print "finish test (%s)!" % test.__name__
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        fs.close()
+        shutil.rmtree(work_root)
+
+
+if __name__ == "__main__":
+    main()
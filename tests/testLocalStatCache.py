@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+"""
+   Copyright 2016 The Trustees of University of Arizona
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+"""
+Local plugin stat cache test
+"""
+
+import traceback
+import os
+import sys
+import shutil
+import tempfile
+
+# import packages under src/
+test_dirpath = os.path.dirname(os.path.abspath(__file__))
+driver_root = os.path.dirname(test_dirpath)
+src_root = os.path.join(driver_root, "src")
+sys.path.append(src_root)
+
+import sgfsdriver.lib.abstractfs as abstractfs
+import sgfsdriver.plugins.local.local_plugin as local_plugin
+
+STAT_CACHE_SIZE = 5
+
+
+class StatCacheTestException(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
+
+
+def check(cond, msg):
+    if not cond:
+        raise StatCacheTestException(msg)
+
+
+def test_full_cache_remove(fs, work_root):
+    """
+    a remove event must replace the cached stat even if the cache is full
+    """
+    for i in range(STAT_CACHE_SIZE):
+        fs.write("/f%d" % i, 0, "data")
+
+    # fill the cache with live entries
+    fs.clear_cache(None)
+    for i in range(STAT_CACHE_SIZE):
+        check(fs.exists("/f%d" % i), "/f%d does not exist" % i)
+    check(len(fs._stat_cache) == STAT_CACHE_SIZE, "cache is not full")
+
+    os.unlink(os.path.join(work_root, "f0"))
+    fs.on_update_detected("remove", os.path.join(work_root, "f0"))
+    check(not fs.exists("/f0"), "removed /f0 still exists")
+
+    # a new entry evicts others
+    fs.write("/g", 0, "data")
+    check(fs.exists("/g"), "/g does not exist")
+    check(len(fs._stat_cache) <= STAT_CACHE_SIZE, "cache is overflown")
+
+
+def test_full_cache_modify(fs, work_root):
+    """
+    a modify event must replace the cached stat even if the cache is full
+    """
+    fs.clear_cache(None)
+    for i in range(1, STAT_CACHE_SIZE):
+        fs.stat("/f%d" % i)
+    fs.stat("/g")
+    check(len(fs._stat_cache) == STAT_CACHE_SIZE, "cache is not full")
+
+    with open(os.path.join(work_root, "f1"), "a") as f:
+        f.write("more data")
+    fs.on_update_detected("modify", os.path.join(work_root, "f1"))
+    check(fs.stat("/f1").size == len("datamore data"),
+          "stat of /f1 is not updated")
+
+
+def test_overflow(fs, work_root):
+    """
+    the cache stays bounded and correct when more paths are stat'ed
+    """
+    fs.clear_cache(None)
+    for i in range(STAT_CACHE_SIZE * 4):
+        fs.write("/h%d" % i, 0, "x" * i)
+        check(fs.stat("/h%d" % i).size == i, "wrong stat of /h%d" % i)
+        check(len(fs._stat_cache) <= STAT_CACHE_SIZE, "cache is overflown")
+
+    entries = fs.list_dir_stat("/")
+    check(len(entries) > STAT_CACHE_SIZE, "wrong list_dir_stat")
+    check(len(fs._stat_cache) <= STAT_CACHE_SIZE, "cache is overflown")
+    for i in range(STAT_CACHE_SIZE * 4):
+        check(fs.stat("/h%d" % i).size == i, "wrong stat of /h%d" % i)
+
+
+def main():
+    local_plugin.STAT_CACHE_SIZE = STAT_CACHE_SIZE
+
+    work_root = tempfile.mkdtemp()
+    fs = local_plugin.plugin_impl(
+        {"work_root": work_root},
+        abstractfs.afsrole.WRITE
+    )
+    try:
+        fs.connect()
+        for test in [test_full_cache_remove, test_full_cache_modify,
+                     test_overflow]:
+            print "start test (%s)!" % test.__name__
+            test(fs, work_root)
+            print "finish test (%s)!" % test.__name__
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        fs.close()
+        shutil.rmtree(work_root)
+
+
+if __name__ == "__main__":
+    main()